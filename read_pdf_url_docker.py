@@ -3,9 +3,11 @@
 #
 # - Locates risk assessment reports (pdf format) from Jan, 2017 onward
 #       - https://www.who.int/influenza/human_animal_interface/HAI_Risk_Assessment/en/,
-# - Downloads 1 report at a time to temp folder, extracts data, then deletes
-#       the download to minimize memory use.
+# - Downloads reports to temp folder, extracts data, then deletes
+#       the download to minimize memory use. Downloads, text extraction and
+#       annex tables run concurrently (see src/pipeline.py).
 # - Exports extracted data as csv's to results folder
+# - With --watch, polls the WHO index and parses new reports as they appear
 #       - H5N1 report
 #       - H7N9 report
 #
@@ -29,12 +31,31 @@ import os
 import urllib
 import datetime
 import sys
+import argparse
 sys.path.append('/WHO_pdf_reader/src')
 # Import helper functions from src/parse_functions.py
-from parse_functions import (find_nth, download_pdf, delete_pdf, 
-    month_to_int, detect_poultry_exposure, detect_report_date, parse_annex_table, 
-    detect_patient_age, detect_patient_gender, detect_onset_date, bad_dates_rep,
-    bad_dates_for)
+from parse_functions import fetch_index, pdf_links
+from pipeline import run_pipeline
+from store import parsed_urls, report_hashes, failed_reports, upsert_reports, export_csv, export_parquet
+from watch import watch_index
+
+# Worker counts for each stage of the pipeline and watch mode
+parser = argparse.ArgumentParser(description = 'Parse WHO avian flu risk assessment reports')
+parser.add_argument('--fetch-workers', type = int, default = 4, help = 'concurrent pdf downloads')
+parser.add_argument('--parse-workers', type = int, default = 2, help = 'text extraction processes')
+parser.add_argument('--annex-workers', type = int, default = 1, help = 'concurrent annex table (tabula) extractions')
+parser.add_argument('--queue-size', type = int, default = 4, help = 'reports waiting between two stages')
+parser.add_argument('--reparse', action = 'store_true', help = 'parse reports already in the result store again')
+parser.add_argument('--no-cache', action = 'store_true', help = 'parse every pdf instead of using cached results')
+parser.add_argument('--watch', action = 'store_true', help = 'keep running and parse new reports as they are published')
+parser.add_argument('--interval', type = int, default = 3600, help = 'seconds between polls of the WHO index in watch mode')
+args = parser.parse_args()
+
+# Results are upserted into a SQLite store that the csv/parquet files are exported from
+results_folder = '/WHO_pdf_reader/results'
+db_path = results_folder + '/WHO-avian-flu-reports.sqlite'
+# Parsed results of each pdf are cached by content hash and parser version
+cache_folder = '/WHO_pdf_reader/cache'
 
 # Supress stderrors for fonts and table formats
 class NullDevice():
@@ -43,207 +64,76 @@ class NullDevice():
 
 sys.stderr = NullDevice()
 
-# connect to WHO website and get list of all pdfs
-url="https://www.who.int/influenza/human_animal_interface/HAI_Risk_Assessment/en/"
-response = request.urlopen(url).read()
-soup= BeautifulSoup(response, "html.parser")     
-links = soup.find_all('a', href=re.compile(r'(.pdf)'))
-
-# clean the pdf link names
-url_list = []
-for link in links:
-    if(link['href'].startswith('http')):
-        url_list.append(link['href'])
+def update_results(url_list):
+    """
+    Parses reports from 2017 onward in url_list that are not yet in the 
+    result store, then exports csv's from the store. Returns False if any
+    report could not be downloaded (and should be retried), True otherwise.
+    Reports that fail to parse are not retried until their pdf changes.
+    """
+    # Locate only reports from 2017 onward
+    index_2017 = url_list.index('https://www.who.int/influenza/human_animal_interface/Influenza_Summary_IRA_HA_interface_01_16_2017_FINAL.pdf')+1
+    print(str(len(url_list[:index_2017])), 'pdfs located')
+    # Skip reports already parsed into the result store
+    if args.reparse:
+        new_urls = url_list[:index_2017]
     else:
-        url_list.append("https://www.who.int" + link['href'])
-
-# Locate only reports from 2017 onward
-index_2017 = url_list.index('https://www.who.int/influenza/human_animal_interface/Influenza_Summary_IRA_HA_interface_01_16_2017_FINAL.pdf')+1
-print(str(len(url_list[:index_2017])), 'pdfs located')
-# Create temp folder to hold pdfs (one at a time)
-folder_location = os.getcwd() + '/tmp_pdfs'
-if not os.path.exists(folder_location):os.mkdir(folder_location)
-
-# Create DFs to record data in (will be exported as csv's)
-df_h7n9 = pd.DataFrame(columns = ['strain', 'age', 'sex', 'date_onset', 'date_announced', 'poultry_exposure', 'sick_human_exposure'])
-df_h5n1 = pd.DataFrame(columns = ['strain', 'age', 'sex', 'date_onset', 'date_announced', 'poultry_exposure', 'sick_human_exposure'])
-
-# Identify pdfs froom 2017 onward on WHO website
-for url in url_list[:index_2017]:
-    file = download_pdf(url, folder_location)  
-    pdfFileObj = open(file, 'rb')
-    # pdf reader object
-    pdfReader = PyPDF2.PdfFileReader(pdfFileObj)
-    # number of pages in pdf
-    num_pages = pdfReader.numPages
-    # extract all text to string
-    pageObj = ''
-    for i in range(num_pages):
-        pageObj = pageObj + pdfReader.getPage(i).extractText()
-    pageObj = pageObj.replace('\n', '')
-
-    # Find report date
-    report_date = detect_report_date(pageObj[:300])
-
-    # New infections header string
-    ni_header = pageObj[pageObj.find('New infections'):pageObj.find('Risk assessment')]
-    # Check for "no new human infections"
-    if re.search(r'[Nn]o new human infection', ni_header):
-        print('No new cases in',report_date,'report')
-
-    # Check for H5N1 or H7N9 infections
-    if not re.search('H5N1', ni_header) and not re.search('H7N9', ni_header):
-        print('No cases of H5N1 or H7N9 in',report_date,'report')
-
-    # Check for H5N1 infections
-    if re.search('H5N1', ni_header):
-        strain = 'H5N1'
-        report_date = report_date
-        # Identify paragraph with information on H7N9 infections
-        info_start = find_nth(pageObj, '[Aa]vian [Ii]nfluenza A\(H5\) viruse?s?', 1)
-        info_par = pageObj[info_start:info_start + find_nth(pageObj[info_start:], 
-                                'Risk [Aa]ssessment', 1)].replace('\n', '')
-        # Print number of cases
-        if re.findall('\w*(?= laboratory-confirmed)', info_par)[0] == 'new':
-                num_case = re.findall('\w*(?= new laboratory-confirmed)', info_par)[0].replace(' ', '')
-        else:
-            num_case = re.findall('\w*(?= laboratory-confirmed)', info_par)[0].replace(' ', '')
-        # If reported number is string, convert to integer
-        if num_case == 'one':
-            num_case = 1
-        elif num_case == 'two':
-            num_case = 2
-        elif num_case == 'three':
-            num_case = 3
-        elif num_case == 'four':
-            num_case = 4
-        elif num_case == 'five':
-            num_case = 5
-        elif num_case == 'six':
-            num_case = 6 
-        print(num_case,'new case(s) of H5N1 detected in',report_date)
-
-        # If annex table exists, extract relevant information to DF
-        if re.findall('[Aa]nnex', info_par) != []:
-            print('Annex detected for H5N1 cases in',report_date)
-            annex_string = "Annex:[\w* \n:-]*A\(H5.*\)"
-            df_annex = parse_annex_table(num_pages, annex_string, strain, report_date, pdfReader, file)
-            df_h5n1 = df_h5n1.append(df_annex)
-        
-        # If no annex table exists, extract information from paragraph
-        # describing H5N1 cases
-        else:
-            # Account for multiple cases described by looping through # of
-            # ages reported in paragraph
-            start_index = 0
-            for case in range(num_case):
-                # Identify patient age -- if multiple cases, set range to search for only current case
-                age = detect_patient_age(info_par[start_index:])
-                if num_case > case+1 and re.findall('(\d{1,2})(:?-?(year|month)(-| )old)',info_par[start_index:]) != []:
-                        next_index = find_nth(info_par, '(:?-?(year|month)(-| )old)',case+2)-3
-                else:
-                    next_index = len(info_par)
-
-                # Identify date of illness onset
-                onset_date = detect_onset_date(pageObj[:300], info_par[start_index:next_index], report_date)
-
-                # Identify gender
-                gender = detect_patient_gender(info_par[start_index:next_index])
-                
-                # Check for poultry exposure
-                poultry_exposure = detect_poultry_exposure(info_par[start_index:next_index])[0]
-
-                # Check for exposure to sick humans
-                sick_human_exposure = detect_poultry_exposure(info_par[start_index:next_index])[1]
-
-                # Add values to data frame
-                df_h5n1 = df_h5n1.append(pd.DataFrame([[strain, age, gender, onset_date, report_date, poultry_exposure, sick_human_exposure]], 
-                                            columns = ['strain', 'age', 'sex', 'date_onset', 'date_announced', 'poultry_exposure', 'sick_human_exposure']))
-                start_index = next_index      
-
-
-    # Check for H7N9 infections
-    if re.search('H7N9', ni_header):
-        strain = 'H7N9'
-        report_date = report_date
-        # Identify paragraph with information on H7N9 infections
-        info_start = find_nth(pageObj, 'Avian [Ii]nfluenza A\(H7N9\)', 1)
-        info_par = pageObj[info_start:info_start + find_nth(pageObj[info_start:], 
-                                'Risk [Aa]ssessment', 1)].replace('\n', '')
-        # Print number of cases
-        if re.findall('\w*(?= laboratory-confirmed)', info_par)[0] == 'new':
-                num_case = re.findall('\w*(?= new laboratory-confirmed)', info_par)[0].replace(' ', '')
-        else:
-            num_case = re.findall('\w*(?= laboratory-confirmed)', info_par)[0].replace(' ', '')
-        # If reported number is string, convert to integer
-        if num_case == 'one':
-            num_case = 1
-        elif num_case == 'two':
-            num_case = 2
-        elif num_case == 'three':
-            num_case = 3
-        elif num_case == 'four':
-            num_case = 4
-        elif num_case == 'five':
-            num_case = 5
-        print(num_case,'new case(s) of H7N9 detected for',report_date)
-
-        # If annex table exists, extract relevant information to DF
-        if re.findall('[Aa]nnex', info_par) != []:
-            print('--Annex detected for H7N9 cases in',report_date)
-            annex_string = "Annex:[\w* \n:-]*A\(H7N9\)"
-            df_annex = parse_annex_table(num_pages, annex_string, strain, report_date, pdfReader, file)
-            df_h7n9 = df_h7n9.append(df_annex)
-
-        # If no annex table exists, extract information from paragraph
-        # describing H7N9 cases
-        else: 
-
-            # Account for multiple cases described by looping through # of
-            # ages reported in paragraph
-            start_index = 0
-            for case in range(num_case):
-                # Identify patient age -- if multiple cases, set range to search for only current case
-                age = detect_patient_age(info_par[start_index:])
-                if num_case > case+1 and re.findall('(\d{1,2})(:?-?(year|month)(-| )old)',info_par[start_index:]) != []:
-                        next_index = find_nth(info_par, '(:?-?(year|month)(-| )old)',case+2)-3
-                else:
-                    next_index = len(info_par)
-
-                # Identify date of illness onset
-                onset_date = detect_onset_date(pageObj[:300], info_par[start_index:next_index], report_date)
-
-                # Identify gender
-                gender = detect_patient_gender(info_par[start_index:next_index])
-                
-                # Check for poultry exposure
-                poultry_exposure = detect_poultry_exposure(info_par[start_index:next_index])[0]
-
-                # Check for exposure to sick humans
-                sick_human_exposure = detect_poultry_exposure(info_par[start_index:next_index])[1]
-
-                # Add values to data frame
-                df_h7n9 = df_h7n9.append(pd.DataFrame([[strain, age, gender, onset_date, report_date, poultry_exposure, sick_human_exposure]], 
-                                            columns = ['strain', 'age', 'sex', 'date_onset', 'date_announced', 'poultry_exposure', 'sick_human_exposure']))
-                start_index = next_index
-
-    delete_pdf(url, folder_location)
-
-df_h7n9.to_csv('/WHO_pdf_reader/results/WHO-avian-flu-H7N9-reports_2017-present.csv')
-df_h5n1.to_csv('/WHO_pdf_reader/results/WHO-avian-flu-H5N1-reports_2017-present.csv')
-
-print()
-print('Date formats other than dd/mm/yyyy detected in:')
-print('Report date | Date detected')
-for key,value in zip(bad_dates_rep, bad_dates_for):
-    print('{:11} | {:8}'.format(key, value))
-print('Manual adjustment to above needed in csv files')
-print()
-print('View generated csv files in the results folder!')
-
-
-# Delete temp folder
-os.removedirs('tmp_pdfs')
+        done_urls = parsed_urls(db_path)
+        new_urls = [url for url in url_list[:index_2017] if url not in done_urls]
+    print(str(len(new_urls)), 'pdfs not yet parsed')
+    if new_urls == []:
+        return(True)
+    # Create temp folder to hold pdfs (a few at a time)
+    folder_location = os.getcwd() + '/tmp_pdfs'
+    if not os.path.exists(folder_location):os.mkdir(folder_location)
+
+    # Download and parse reports through the staged pipeline
+    reports = run_pipeline(new_urls, folder_location, 
+        fetch_workers = args.fetch_workers, parse_workers = args.parse_workers, 
+        annex_workers = args.annex_workers, queue_size = args.queue_size,
+        cache_folder = None if args.no_cache else cache_folder, 
+        known_hashes = report_hashes(db_path),
+        failed_reports = None if args.reparse else failed_reports(db_path))
+
+    # Record reports and cases in the result store, then export csv's from it
+    upsert_reports(db_path, reports)
+    export_csv(db_path, 'H7N9', results_folder + '/WHO-avian-flu-H7N9-reports_2017-present.csv')
+    export_csv(db_path, 'H5N1', results_folder + '/WHO-avian-flu-H5N1-reports_2017-present.csv')
+    if not export_parquet(db_path, results_folder + '/WHO-avian-flu-reports_2017-present.parquet'):
+        print('Parquet export skipped -- requires pyarrow or fastparquet')
+
+    print()
+    print('Date formats other than dd/mm/yyyy detected in:')
+    print('Report date | Date detected')
+    for report in reports:
+        for key,value in report['bad_dates']:
+            print('{:11} | {:8}'.format(key, value))
+    print('Manual adjustment to above needed in csv files')
+    print()
+    failed = [report for report in reports if report['status'] != 'ok']
+    if failed != []:
+        print('Reports that could not be parsed:')
+        for report in failed:
+            print(report['url'], '|', report['status'])
+        print()
+    print('View generated csv files in the results folder!')
+
+    # Delete temp folder
+    os.removedirs('tmp_pdfs')
+    # Reports without a pdf hash could not be downloaded
+    return(all(report['sha256'] is not None for report in failed))
+
+# WHO website listing all pdfs
+index_url = "https://www.who.int/influenza/human_animal_interface/HAI_Risk_Assessment/en/"
+# Guarded so the text extraction processes (see src/pipeline.py) can import this script
+if __name__ == '__main__':
+    if args.watch:
+        # Poll the index and parse only new reports when it changes
+        watch_index(index_url, db_path, update_results, interval = args.interval)
+    else:
+        # connect to WHO website and get list of all pdfs
+        html, etag, last_modified = fetch_index(index_url)
+        update_results(pdf_links(html))
 
 # Sources:
     # Read PDF Table
@@ -0,0 +1,109 @@
+# Parsed-result cache for read_pdf_url.py
+# Maps (sha256 of the pdf contents, parser version, pdf/table backend) to the
+# parsed cases and diagnostics, so identical pdfs -- re-uploads under new URLs,
+# reruns, docker and local runs sharing the repository -- are only parsed once.
+#
+# The parser version is a hash of src/parse_functions.py, so any change to the
+# parsing code invalidates the cache. Entries are pickles of plain Python
+# values in the cache folder; entries of other parser versions are deleted
+# and the least recently used are evicted beyond max_entries, whatever their
+# backend, so docker and local runs can share the folder.
+
+import os
+import pickle
+import hashlib
+import tempfile
+import PyPDF2
+import tabula
+import pandas as pd
+import parse_functions
+from parse_functions import case_columns
+
+def _parser_version():
+    """Returns hash of the parsing code in parse_functions.py"""
+    with open(os.path.splitext(parse_functions.__file__)[0] + '.py', 'rb') as file:
+        return(hashlib.sha256(file.read()).hexdigest()[:16])
+
+parser_version = _parser_version()
+backend = 'PyPDF2-{}_tabula-{}'.format(getattr(PyPDF2, '__version__', 'unknown'),
+                                       getattr(tabula, '__version__', 'unknown'))
+# Report fields stored in the cache
+cached_fields = ['report_date', 'num_pages', 'cases', 'bad_dates']
+
+def _entry_path(cache_folder, sha256):
+    """Returns path of the cache entry for a pdf"""
+    backend_id = hashlib.sha256(backend.encode()).hexdigest()[:8]
+    return(cache_folder + '/' + sha256 + '-' + parser_version + '-' + backend_id + '.pkl')
+
+def get_cached(cache_folder, sha256):
+    """
+    Returns the cached parse of the pdf with contents hash sha256 as a dict
+    with keys report_date, num_pages, cases and bad_dates, or None if the pdf
+    has not been parsed by this parser version and backend. Entries that
+    cannot be read are deleted and treated as a miss.
+    """
+    path = _entry_path(cache_folder, sha256)
+    if not os.path.exists(path):
+        return(None)
+    try:
+        with open(path, 'rb') as file:
+            result = pickle.load(file)
+        result['cases'] = pd.DataFrame(result['cases'], columns = case_columns)
+        # Mark entry as recently used
+        os.utime(path)
+    except Exception:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return(None)
+    return(result)
+
+def put_cached(cache_folder, sha256, report):
+    """Stores the parsed fields of report in the cache"""
+    if not os.path.exists(cache_folder):os.makedirs(cache_folder, exist_ok = True)
+    path = _entry_path(cache_folder, sha256)
+    result = {field : report[field] for field in cached_fields}
+    # Cases are stored as plain rows (not a pickled DataFrame), so entries
+    # can be read by other pandas/Python versions sharing the cache
+    result['cases'] = report['cases'][case_columns].values.tolist()
+    # Write to a temporary file first so concurrent runs never read partial
+    # entries -- the name is unique per call, as pipeline threads share a pid
+    tmp_handle, tmp_path = tempfile.mkstemp(dir = cache_folder, suffix = '.tmp')
+    try:
+        with os.fdopen(tmp_handle, 'wb') as file:
+            # Protocol 4 is readable by the Python 3.7 docker image
+            pickle.dump(result, file, protocol = 4)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def prune_cache(cache_folder, max_entries = 1000):
+    """
+    Deletes entries written by other parser versions, then the least 
+    recently used entries (of any backend) beyond max_entries
+    """
+    if not os.path.exists(cache_folder):
+        return
+    entries = []
+    for name in os.listdir(cache_folder):
+        if not name.endswith('.pkl'):
+            continue
+        path = cache_folder + '/' + name
+        try:
+            if name.split('-')[1] != parser_version:
+                os.remove(path)
+            else:
+                entries.append((os.path.getmtime(path), path))
+        except (IndexError, OSError):
+            continue
+    entries.sort(reverse = True)
+    for mtime, path in entries[max_entries:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,77 @@
+# Incidence counts for modeling
+# Loads the weekly/monthly case counts kept in the incidence table of the
+# result store (see src/store.py) as NumPy arrays or DataFrames, so model
+# runs do not need to re-read and group the case-level csv's.
+#
+# Example:
+#   counts, axes = incidence_array('results/WHO-avian-flu-reports.sqlite', 'onset', 'week')
+#   counts[:, axes['strain'].index('H7N9')].sum(axis = (1, 2, 3))  # weekly H7N9 cases
+
+import datetime
+import numpy as np
+import pandas as pd
+from store import open_store, age_bands
+
+# Categories along each axis of the incidence array, after the period axis
+dimensions = {
+    'strain' : ['H5N1', 'H7N9'],
+    'sex' : ['f', 'm', 'unknown'],
+    'age_band' : [label for label, lowest in age_bands] + ['unknown'],
+    'exposure' : ['0', '1', 'unknown']
+    }
+
+def _periods(first, last, freq):
+    """Returns every week (monday, yyyy-mm-dd) or month (yyyy-mm) from first to last"""
+    if freq == 'week':
+        first = datetime.datetime.strptime(first, '%Y-%m-%d').date()
+        last = datetime.datetime.strptime(last, '%Y-%m-%d').date()
+        return([(first + datetime.timedelta(weeks = i)).isoformat()
+                for i in range((last - first).days // 7 + 1)])
+    return([str(period) for period in pd.period_range(first, last, freq = 'M')])
+
+def incidence_array(db_path, date_kind = 'onset', freq = 'week'):
+    """
+    Returns case counts from the result store as a NumPy array
+
+    Parameters
+    ----------
+    db_path (str): path to the SQLite result store
+
+    date_kind (str): 'onset' or 'announced' -- date the cases are counted by
+
+    freq (str): 'week' or 'month'
+
+    Returns
+    -------
+    counts (numpy.ndarray): array of shape (period, strain, sex, age_band, exposure),
+    with a row for every period between the first and last with cases
+
+    axes (dict): labels along each axis -- 'period' and the keys of dimensions
+    """
+    if date_kind not in ['onset', 'announced'] or freq not in ['week', 'month']:
+        raise ValueError("date_kind must be 'onset' or 'announced' and freq 'week' or 'month'")
+    conn = open_store(db_path)
+    rows = conn.execute("SELECT period, strain, sex, age_band, exposure, count FROM incidence "
+        "WHERE date_kind = ? AND freq = ? ORDER BY period", (date_kind, freq)).fetchall()
+    conn.close()
+    axes = {'period' : _periods(rows[0][0], rows[-1][0], freq) if rows != [] else []}
+    axes.update(dimensions)
+    positions = {axis : {label : i for i, label in enumerate(labels)} for axis, labels in axes.items()}
+    counts = np.zeros([len(labels) for labels in axes.values()], dtype = int)
+    for row in rows:
+        # Strains other than H5N1/H7N9 are not part of the array
+        if row[1] not in positions['strain']:
+            continue
+        counts[tuple(positions[axis][label] for axis, label in zip(axes, row[:5]))] += row[5]
+    return(counts, axes)
+
+def incidence_frame(db_path, date_kind = 'onset', freq = 'week'):
+    """
+    Returns case counts from the result store as a DataFrame indexed by
+    period, with columns (strain, sex, age_band, exposure) -- see incidence_array
+    """
+    counts, axes = incidence_array(db_path, date_kind, freq)
+    columns = pd.MultiIndex.from_product([axes[axis] for axis in dimensions], names = list(dimensions))
+    # Explicit column count, as an empty store has no periods to infer it from
+    return(pd.DataFrame(counts.reshape(len(axes['period']), int(np.prod(counts.shape[1:]))),
+                        index = pd.Index(axes['period'], name = 'period'), columns = columns))
@@ -2,6 +2,7 @@
 # Cari Gostic -- updated Feb 18, 2020
 
 import re
+import pandas as pd
 # Requires PyPDF2
 import PyPDF2
 # tabula requires java version 1.8.0 or greater. 
@@ -13,40 +14,101 @@ from urllib import request
 from bs4 import BeautifulSoup
 import os
 import urllib
+import urllib.error
 import datetime
+import hashlib
 
 bad_dates_rep = []
 bad_dates_for = []
 
-def find_nth(haystack, needle, n):
+# Header of the paragraph describing new cases of each strain
+strain_paragraphs = {
+    'H5N1' : '[Aa]vian [Ii]nfluenza A\(H5\) viruse?s?',
+    'H7N9' : 'Avian [Ii]nfluenza A\(H7N9\)'
+    }
+
+# Header of the annex table listing new cases of each strain
+annex_strings = {
+    'H5N1' : "Annex:[\w* \n:-]*A\(H5.*\)",
+    'H7N9' : "Annex:[\w* \n:-]*A\(H7N9\)"
+    }
+
+# Anchor starting the description of each case in a paragraph ("19-year-old", "8-month-old")
+case_anchor = re.compile('(\d{1,2}) ?:?-?(year|month)(?:-| )old')
+
+# Keywords locating the sex, onset date and exposure in the description of a case.
+# Surrounding spaces are matched with lookarounds so that neighbouring keywords
+# (" her poultry ") do not consume each other's spaces.
+case_keywords = re.compile('(?P<sex>female|male)|(?<= )(?P<pronoun>[Hh]e|[Ss]he|[Hh]er)(?= )'
+    '|(?<= )(?P<person>[Mm]an|[Ww]oman)(?= )|(?P<symptoms>[Ss]ymptoms)|(?P<onset>[Oo]nset)'
+    '|(?P<developed>developed)|(?<= )(?P<poultry>poultry)(?= )|(?P<exposure>exposure)(?= )'
+    '|(?P<birds>birds?)(?= )')
+
+# Day and month following an onset keyword, within four words
+onset_pattern = re.compile(' (?:\w* ){0,4}(\d{1,2}) (\w*)')
+
+months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+sentence_chars = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ ,')
+word_chars = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_ ')
+
+case_columns = ['strain', 'age', 'sex', 'date_onset', 'date_announced', 'poultry_exposure', 'sick_human_exposure']
+
+def fetch_index(index_url, etag = None, last_modified = None):
     """
-    Finds nth occurrence of a string in a piece of text.
-    If n is negative, returns nth instance of string from
-    the end of the text.
+    Downloads the WHO risk assessment index page with a conditional request
 
     Parameters
     ----------
-    haystack (str): piece of text to search through
+    index_url (str): URL of the page listing the pdf reports
 
-    needle (str): string to search for in text
+    etag, last_modified (str): ETag and Last-Modified headers returned
+    by the previous request (None if unknown)
 
-    n (int): which occurence to identify (1st, 2nd, 3rd)
-
-    Returns:
+    Returns
     -------
-    int:
-        position in haystack where nth occurrence of
-        needle starts.
+    html (bytes or None): page contents, or None if the page is unchanged
+
+    etag, last_modified (str): headers to send with the next request
     """
-    if n < 0:
-        return [match.start(0) for match in re.finditer(needle, haystack)][n]
-    else:
-        return [match.start(0) for match in re.finditer(needle, haystack)][n-1]
+    headers = {}
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+    try:
+        response = request.urlopen(request.Request(index_url, headers = headers))
+    except urllib.error.HTTPError as error:
+        if error.code == 304:
+            return(None, etag, last_modified)
+        raise
+    html = response.read()
+    return(html, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+def pdf_links(html):
+    """Returns list of absolute URLs of the pdfs linked from the index page"""
+    soup = BeautifulSoup(html, "html.parser")
+    links = soup.find_all('a', href=re.compile(r'(.pdf)'))
+    # clean the pdf link names
+    url_list = []
+    for link in links:
+        if(link['href'].startswith('http')):
+            url_list.append(link['href'])
+        else:
+            url_list.append("https://www.who.int" + link['href'])
+    return(url_list)
+
+def pdf_filename(download_url):
+    """
+    Returns local filename for pdf downloaded from URL -- the filename
+    from the URL prefixed with a hash of the full URL, so reports sharing
+    a filename under different URLs do not overwrite each other
+    """
+    return(hashlib.sha1(download_url.encode()).hexdigest()[:10]+'_'+download_url.split('/')[-1])
 
 def download_pdf(download_url, folder):
     """
     Downloads pdf from specified url and saves to specified 
-    filepath under filename from URL
+    filepath under filename from URL (see pdf_filename)
     
     Parameters
     ----------
@@ -59,12 +121,20 @@ def download_pdf(download_url, folder):
     file_path (str): path to downloaded file
     """
     response = urllib.request.urlopen(download_url)
-    filename = download_url.split('/')[-1]
+    filename = pdf_filename(download_url)
     file = open(folder+'/'+filename, 'wb')
     file.write(response.read())
     file.close()
     return(folder+'/'+filename)
 
+def hash_pdf(file_path):
+    """Returns sha256 hex digest of the contents of a downloaded pdf"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(65536), b''):
+            sha256.update(block)
+    return(sha256.hexdigest())
+
 def delete_pdf(download_url, folder):
     """
     Deletes pdf that was downloaded from URL to
@@ -76,7 +146,7 @@ def delete_pdf(download_url, folder):
 
     folder (str): filepath where pdf exists locally
     """
-    filename = download_url.split('/')[-1]
+    filename = pdf_filename(download_url)
     os.remove(folder+'/'+filename)
 
 def month_to_int(mmm):
@@ -102,10 +172,312 @@ def detect_report_date(pageObj):
         date_header = re.findall('(?<=Summary and assessment).* (\d{1,2} \w* \d\d\d\d).*(?=Since)', pageObj)[0].split(' ')
         report_date = date_header[2]+'-'+month_to_int(date_header[1][:3])+'-'+date_header[0]
     else:
-        report_date = 'weird report date detected for '+url
+        report_date = 'weird report date detected'
     return(report_date)
 
-def parse_annex_table(num_pages,annex_string, strain, report_date, pdfReader, file):
+def extract_text(pdfReader, start, stop):
+    """Returns text of pages start to stop (exclusive) of pdf with newlines removed"""
+    text = ''
+    for i in range(start, stop):
+        text = text + pdfReader.getPage(i).extractText()
+    return(text.replace('\n', ''))
+
+def locate_strain_paragraph(pageObj, strain):
+    """
+    Returns paragraph describing new cases of strain in WHO assessment, 
+    or None if the paragraph is not complete in pageObj
+
+    Parameters
+    ----------
+    pageObj (str): text extracted from the report
+
+    strain (str): flu strain (H5N1 or H7N9)
+
+    Returns
+    -------
+    str or None:
+        text from paragraph header up to the following "Risk assessment"
+    """
+    info_start = re.search(strain_paragraphs[strain], pageObj)
+    if info_start is None:
+        return(None)
+    info_end = re.compile('Risk [Aa]ssessment').search(pageObj, info_start.start())
+    if info_end is None:
+        return(None)
+    return(pageObj[info_start.start():info_end.start()])
+
+def triage_report(pdfReader, num_pages, triage_pages=2):
+    """
+    Classifies WHO assessment report from the report date header and
+    "New infections" section on its first pages, so that full text 
+    extraction and tabula only run on reports with new H5N1/H7N9 cases.
+    Further pages are only read if the sections needed are not complete
+    within the first triage_pages.
+
+    Parameters
+    ----------
+    pdfReader (PyPDF2.PdfFileReader): reader for the downloaded report
+
+    num_pages (int): The number of pages in the pdf
+
+    triage_pages (int): number of pages to read before classifying
+
+    Returns
+    -------
+    route (str): 'skip' (no H5N1/H7N9 cases), 'paragraph' (cases only 
+        described in paragraphs) or 'annex' (at least one strain has an
+        annex table)
+
+    strain_routes (dict): for each strain with new cases, a tuple of its
+        route ('paragraph' or 'annex') and the paragraph describing its
+        cases (None if the paragraph could not be located)
+
+    report_date (str): The WHO assessment report date
+
+    ni_header (str): text of the "New infections" section
+
+    pageObj (str): text of the pages read during triage
+    """
+    pages_read = min(triage_pages, num_pages)
+    pageObj = extract_text(pdfReader, 0, pages_read)
+    report_date = detect_report_date(pageObj[:300])
+
+    # New infections header string -- read on until the section is complete
+    while pageObj.find('Risk assessment') == -1 and pages_read < num_pages:
+        pageObj = pageObj + extract_text(pdfReader, pages_read, pages_read + 1)
+        pages_read = pages_read + 1
+    ni_header = pageObj[pageObj.find('New infections'):pageObj.find('Risk assessment')]
+
+    strains = [strain for strain in strain_paragraphs if re.search(strain, ni_header)]
+    strain_routes = {}
+    for strain in strains:
+        # Read on until paragraph describing cases is complete
+        while locate_strain_paragraph(pageObj, strain) is None and pages_read < num_pages:
+            pageObj = pageObj + extract_text(pdfReader, pages_read, pages_read + 1)
+            pages_read = pages_read + 1
+        info_par = locate_strain_paragraph(pageObj, strain)
+        if info_par is not None and re.findall('[Aa]nnex', info_par) != []:
+            strain_routes[strain] = ('annex', info_par)
+        else:
+            strain_routes[strain] = ('paragraph', info_par)
+
+    if strain_routes == {}:
+        route = 'skip'
+    elif 'annex' in [strain_route for strain_route, info_par in strain_routes.values()]:
+        route = 'annex'
+    else:
+        route = 'paragraph'
+    return(route, strain_routes, report_date, ni_header, pageObj)
+
+def count_new_cases(info_par):
+    """Returns number of new laboratory-confirmed cases described in paragraph of WHO assessment"""
+    if re.findall('\w*(?= laboratory-confirmed)', info_par)[0] == 'new':
+        num_case = re.findall('\w*(?= new laboratory-confirmed)', info_par)[0].replace(' ', '')
+    else:
+        num_case = re.findall('\w*(?= laboratory-confirmed)', info_par)[0].replace(' ', '')
+    # If reported number is string, convert to integer
+    if num_case.isdigit():
+        return(int(num_case))
+    return{
+        'one' : 1,
+        'two' : 2,
+        'three' : 3,
+        'four' : 4,
+        'five' : 5,
+        'six' : 6,
+        'seven' : 7,
+        'eight' : 8,
+        'nine' : 9,
+        'ten' : 10
+        }[num_case]
+
+def split_cases(info_par, num_case):
+    """
+    Splits paragraph of WHO assessment into the description of each case
+    at the "N-year-old" anchors, in a single pass over the paragraph.
+    The first case also includes the text before its anchor, and the last 
+    case runs to the end of the paragraph.
+
+    Returns
+    -------
+    list:
+        (age, span) for each case -- age is in years, or in months as in
+        annex tables (e.g. '8 months' for an 8-month-old), or 'unknown' with
+        an empty span for cases without an anchor
+    """
+    anchors = []
+    for anchor in case_anchor.finditer(info_par):
+        anchors.append(anchor)
+        if len(anchors) == num_case:
+            break
+    starts = [0] + [anchor.start() for anchor in anchors[1:]]
+    starts = starts + [len(info_par)] * (num_case - len(starts))
+    ends = starts[1:] + [len(info_par)]
+    ages = [anchor.group(1) if anchor.group(2) == 'year' else anchor.group(1) + ' months'
+            for anchor in anchors] + ['unknown'] * (num_case - len(anchors))
+    return([(age, info_par[start:end]) for age, start, end in zip(ages, starts, ends)])
+
+def _sentence_bounds(text, pos, allowed):
+    """Returns start and end of the run of characters in allowed around pos"""
+    start = pos
+    while start > 0 and text[start - 1] in allowed:
+        start = start - 1
+    end = pos
+    while end < len(text) and text[end] in allowed:
+        end = end + 1
+    return(start, end)
+
+def parse_case_span(span, report_date):
+    """
+    Extracts sex, onset date and exposure of one case described in a WHO 
+    assessment, from a single scan of the keywords in its description.
+
+    Parameters
+    ----------
+    span (str): description of the case (see split_cases)
+
+    report_date (str): The WHO assessment report date
+
+    Returns
+    -------
+    tuple:
+        gender, onset_date, poultry_exposure, sick_human_exposure
+    """
+    found = {}
+    for keyword in case_keywords.finditer(span):
+        found.setdefault(keyword.lastgroup, []).append(keyword)
+
+    # Look for either MALE or FEMALE, or in case where
+    # gender is not explicitly stated, search for pronouns
+    gender = 'Not reported as male/female...Check report of '+report_date
+    for kind in ['sex', 'pronoun', 'person']:
+        words = [keyword.group(0).lower() for keyword in found.get(kind, [])]
+        if kind == 'pronoun':
+            # Pronouns are used when "he" or "her" appears, and the first
+            # "he"/"she" decides (only "her" means female)
+            if 'he' not in words and 'her' not in words:
+                continue
+            words = [word for word in words if word != 'her'] or words
+        if words != []:
+            gender = 'm' if words[0] in ['male', 'he', 'man'] else 'f'
+            break
+
+    # Date in sentence with "symptoms", "onset", or "developed", in that order
+    if report_date.startswith('weird'):
+        onset_date = 'bad report date'
+    else:
+        onset_date = 'check onset date format for report of '+report_date
+        for kind in ['symptoms', 'onset', 'developed']:
+            for keyword in found.get(kind, []):
+                date = onset_pattern.match(span, keyword.end())
+                if date is not None and date.group(2)[:3] in months:
+                    onset_date = report_date.split('-')[0]+'-'+month_to_int(date.group(2)[:3])+'-'+date.group(1)
+                    break
+            if not onset_date.startswith('check'):
+                break
+
+    # Sentence describing exposure: first sentence mentioning poultry, 
+    # otherwise the words around "exposure" or "bird(s)"
+    poul_sentence = None
+    for keyword in found.get('poultry', []):
+        start, end = _sentence_bounds(span, keyword.start(), sentence_chars)
+        if start > 0 and span[start - 1] == '.' and span[start] == ' ' and end < len(span) and span[end] in '.;':
+            poul_sentence = span[start:end]
+            break
+    for kind in ['exposure', 'birds']:
+        if poul_sentence is None and kind in found:
+            start, end = _sentence_bounds(span, found[kind][0].start(), word_chars)
+            poul_sentence = span[start:end][:span[start:end].rfind(' ') + 1]
+    # Code exposure as binary 1 = exposure, 0 = no exposure
+    if poul_sentence is None:
+        poultry_exposure = 'unknown'
+    elif not re.search('([Nn]o |not|none)', poul_sentence):
+        poultry_exposure = 1
+    else:
+        poultry_exposure = 0
+    sick_human_exposure = 0
+    return(gender, onset_date, poultry_exposure, sick_human_exposure)
+
+def parse_case_paragraph(info_par, num_case, strain, report_date):
+    """
+    Parses cases described in paragraph of WHO assessment report into 
+    pandas dataframe with columns strain, age, sex, date_onset, 
+    date_announced, poultry_exposure, sick_human_exposure.
+
+    Parameters
+    ----------
+    info_par (str): paragraph describing new cases of strain
+
+    num_case (int): number of new cases described in paragraph
+
+    strain (str): flu strain
+
+    report_date (str): The WHO assessment report date
+
+    Returns
+    -------
+    DataFrame Object
+        A dataframe with one row per case
+    """
+    rows = []
+    for age, span in split_cases(info_par, num_case):
+        gender, onset_date, poultry_exposure, sick_human_exposure = parse_case_span(span, report_date)
+        rows.append([strain, age, gender, onset_date, report_date, poultry_exposure, sick_human_exposure])
+    return(pd.DataFrame(rows, columns = case_columns))
+
+def parse_report(pdfReader, num_pages):
+    """
+    Parses new H5N1/H7N9 cases described in the paragraphs of a WHO 
+    assessment report, and identifies strains whose cases are listed
+    in an annex table instead.
+
+    Parameters
+    ----------
+    pdfReader (PyPDF2.PdfFileReader): reader for the downloaded report
+
+    num_pages (int): The number of pages in the pdf
+
+    Returns
+    -------
+    report_date (str): The WHO assessment report date
+
+    cases (DataFrame): cases described in paragraphs
+
+    annex_strains (list): strains with an annex table to parse
+    """
+    # Triage report from the date header and "New infections" section on 
+    # its first pages -- only reports with new cases are read further
+    route, strain_routes, report_date, ni_header, pageObj = triage_report(pdfReader, num_pages)
+    cases = [pd.DataFrame(columns = case_columns)]
+    annex_strains = []
+
+    # Check for "no new human infections"
+    if re.search(r'[Nn]o new human infection', ni_header):
+        print('No new cases in',report_date,'report')
+
+    # Check for H5N1 or H7N9 infections
+    if route == 'skip':
+        print('No cases of H5N1 or H7N9 in',report_date,'report')
+        return(report_date, cases[0], annex_strains)
+
+    for strain, (strain_route, info_par) in strain_routes.items():
+        if info_par is None:
+            raise ValueError('paragraph describing '+strain+' cases not found in '+report_date+' report')
+        num_case = count_new_cases(info_par)
+        print(num_case,'new case(s) of',strain,'detected in',report_date)
+
+        # If annex table exists, leave for annex table extraction
+        if strain_route == 'annex':
+            print('Annex detected for',strain,'cases in',report_date)
+            annex_strains.append(strain)
+        # If no annex table exists, extract information from paragraph
+        # describing cases
+        else:
+            cases.append(parse_case_paragraph(info_par, num_case, strain, report_date))
+    return(report_date, pd.concat(cases, sort = False), annex_strains)
+
+def parse_annex_table(num_pages, annex_string, strain, report_date, pdfReader, file,
+        bad_dates_rep = bad_dates_rep, bad_dates_for = bad_dates_for):
     """
     Parses annex table in WHO assessment report into pandas dataframe
     with columns strain, age, sex, date_onset, date_announced, exposure.
@@ -121,6 +493,9 @@ def parse_annex_table(num_pages,annex_string, strain, report_date, pdfReader, fi
 
     report_date (str): The WHO assessment report date (dd-Mmm-yyyy)
 
+    bad_dates_rep, bad_dates_for (list): lists recording report dates and
+    onset dates that do not match the dd/mm/yyyy convention
+
     Returns
     -------
     DataFrame Object
@@ -188,77 +563,6 @@ def parse_annex_table(num_pages,annex_string, strain, report_date, pdfReader, fi
                         'poultry_exposure', 'sick_human_exposure']]
     return(df_annex)
 
-def detect_patient_age(info_par):
-    """Returns age of patient described in paragraph of WHO assessment"""
-    # Searches for "year-old" or 'year old'
-    if re.findall('(\d{1,2}) ?(:?-?(year|month)(-| )old)',info_par) != []:
-        age = re.findall('(\d{1,2}) ?(:?-?(year|month)(-| )old)',info_par)[0][0]
-    else:
-        age = 'unknown'
-    return(age)
-
-def detect_onset_date(pageObj,info_par, report_date):
-    """Returns the illness onset date as described in paragraph of WHO assessment"""
-    # Seaches for date in sentence with "symptoms", "developed", or "onset"
-    date_header = re.findall('(?<=Summary and assessment).* (\d{1,2} \w* \d\d\d\d).*(?=Since)', pageObj)[0].split(' ')
-    if re.findall('(?:[Ss]ymptoms)( (\w* ){0,4})(\d{1,2} \w*)', info_par) != [] and not report_date.startswith('weird'):
-        onset_date_dm = re.findall('(?:[Ss]ymptoms)( (\w* ){0,4})(\d{1,2} \w*)',info_par)[0][-1].split(' ')
-        onset_date = date_header[2]+'-'+month_to_int(onset_date_dm[1][:3])+'-'+onset_date_dm[0]
-    elif re.findall('(?:[Oo]nset)( (\w* ){0,4})(\d{1,2} \w*)', info_par) != [] and not report_date.startswith('weird'):
-        onset_date_dm = re.findall('(?:[Oo]nset)( (\w* ){0,4})(\d{1,2} \w*)',info_par)[0][-1].split(' ')
-        onset_date = date_header[2]+'-'+month_to_int(onset_date_dm[1][:3])+'-'+onset_date_dm[0]
-    elif re.findall('(?:developed (\w* ){0,4})(\d{1,2} \w*)', info_par) != [] and not report_date.startswith('weird'):
-        onset_date_dm = re.findall('(?:developed (\w* ){0,4})(\d{1,2} \w*)',info_par)[0][-1].split(' ')
-        onset_date = date_header[2]+'-'+month_to_int(onset_date_dm[1][:3])+'-'+onset_date_dm[0]
-    else:
-        if report_date.startswith('weird'):
-            onset_date = 'bad report date'
-        else:
-            onset_date = 'check onset date format for '+url
-    return(onset_date)
-
-def detect_patient_gender(info_par):
-    """Returns the age of patient described in WHO assessment"""
-    # Look for either MALE or FEMALE, or in case where
-    # gender is not explicitly stated, search for pronouns
-    if re.findall('(male|female)', info_par) != []:
-        gender = re.findall('(male|female)', info_par)[0][0]
-    elif re.findall('( [Hh]e | [Hh]er )', info_par) != []:
-        gender = re.findall('( [Hh]e | [Ss]he )', info_par)[0]
-        if gender == ' he ' or gender == ' He ':
-            gender = 'm'
-        else:
-            gender = 'f'
-    elif re.findall('( [Mm]an | [Ww]oman )', info_par) != []:
-        gender = re.findall('( [Mm]an | [Ww]oman )', info_par)[0]
-        if gender == ' man ' or gender == ' Man ':
-            gender = 'm'
-        else:
-            gender = 'f'
-    else:
-        gender = 'Not reported as male/female...Check '+url
-    return(gender)
-
-def detect_poultry_exposure(info_par):
-    """
-    Returns poultry exposure (binary, 0 = no exposure, 1 = exposure) as described
-    in WHO assessment report
-    """
-    if re.findall('(?<=\.)( [A-Za-z ,]* poultry [A-Za-z ,]*)(\.|;)',info_par) != []:
-        poul_sentence = re.findall('((?<=\.)( [A-Za-z ,]* poultry [A-Za-z ,]*)(\.|;))',info_par)[0][0]
-    elif re.findall('(\w* )*(exposure )(\w* )*', info_par) != []:
-        poul_sentence = re.findall('((\w* )*(exposure )(\w* )*)', info_par)[0][0]
-    elif re.findall('(\w* )*(birds? )(\w* )*', info_par) != []:
-        poul_sentence = re.findall('((\w* )*(birds? )(\w* )*)', info_par)[0][0]
-    # Code exposure as binary 1 = exposure, 0 = no exposure
-    if not re.search('([Nn]o |not|none)', poul_sentence):
-        poultry_exposure = 1
-        sick_human_exposure = 0
-    else:
-        poultry_exposure = 0
-        sick_human_exposure = 0
-    return(poultry_exposure, sick_human_exposure)
-
 def convert_date(string, report_date, bad_dates_rep, bad_dates_for):
     """
     Converts date string in format dd/mm/yyyy
@@ -0,0 +1,236 @@
+# Staged pipeline for read_pdf_url.py
+# Downloads (network), text parsing (CPU) and annex table extraction (JVM)
+# run in separate worker pools connected by bounded queues, so a long
+# backfill is limited by the slowest stage rather than the sum of all stages.
+#
+# Workers are threads: downloads wait on the network and tabula runs java
+# in a subprocess, so those stages overlap freely with text parsing.
+# PyPDF2 text extraction holds the GIL, so each parse worker hands its pdf
+# to a pool of as many processes, which reopen the pdf by path and return
+# the parsed fields -- parse workers then use one core each.
+
+import queue
+import threading
+import concurrent.futures
+import pandas as pd
+# Requires PyPDF2
+import PyPDF2
+from parse_functions import (download_pdf, delete_pdf, hash_pdf, parse_report,
+    parse_annex_table, annex_strings, case_columns)
+from cache import get_cached, put_cached, prune_cache
+
+# Marks the end of the work put on a queue
+_DONE = object()
+
+def _run_stage(work, inbox, outbox, num_workers, num_downstream):
+    """
+    Starts num_workers threads that call work(report) on each report from
+    inbox and put the returned report (if any) on outbox. A report whose 
+    work raises is marked with the error and dropped. Once the inbox is
+    drained, the last worker to finish signals num_downstream workers of
+    the next stage.
+
+    Returns
+    -------
+    list: started worker threads
+    """
+    remaining = [num_workers]
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            while True:
+                report = inbox.get()
+                if report is _DONE:
+                    break
+                try:
+                    report = work(report)
+                except Exception as error:
+                    # Record the report as failed and keep the worker going
+                    report['status'] = repr(error)
+                    print('Could not process', report['url'], '-', report['status'])
+                    try:
+                        _finish(report)
+                    except OSError:
+                        pass
+                    continue
+                if report is not None and outbox is not None:
+                    # Blocks while the next stage is behind (backpressure)
+                    outbox.put(report)
+        finally:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0 and outbox is not None:
+                    for i in range(num_downstream):
+                        outbox.put(_DONE)
+
+    threads = [threading.Thread(target = worker, daemon = True) for i in range(num_workers)]
+    for thread in threads:
+        thread.start()
+    return(threads)
+
+def _finish(report):
+    """Closes and deletes the downloaded pdf of a report"""
+    if report.get('pdfFileObj') is not None:
+        report.pop('pdfFileObj').close()
+        report.pop('pdfReader', None)
+    if report.get('file') is not None:
+        delete_pdf(report['url'], report['folder'])
+        report.pop('file')
+    report.pop('folder', None)
+
+def _parse_file(file):
+    """
+    Extracts report date, cases and annex strains of a downloaded pdf, 
+    in a worker process of the parse stage
+
+    Returns
+    -------
+    tuple: (report_date, num_pages, cases, annex_strains)
+    """
+    with open(file, 'rb') as pdfFileObj:
+        pdfReader = PyPDF2.PdfFileReader(pdfFileObj)
+        num_pages = pdfReader.numPages
+        report_date, cases, annex_strains = parse_report(pdfReader, num_pages)
+    return(report_date, num_pages, cases, annex_strains)
+
+def run_pipeline(url_list, folder_location, fetch_workers = 4, parse_workers = 2,
+        annex_workers = 1, queue_size = 4, cache_folder = None, known_hashes = None,
+        failed_reports = None):
+    """
+    Downloads and parses WHO assessment reports through a staged pipeline
+
+    Parameters
+    ----------
+    url_list (list): URLs of the pdf reports to parse
+
+    folder_location (str): local filepath in which to save pdfs while parsing
+
+    fetch_workers (int): number of concurrent downloads
+
+    parse_workers (int): number of text extraction processes
+
+    annex_workers (int): number of concurrent annex table (tabula) extractions
+
+    queue_size (int): maximum number of reports waiting between two stages
+
+    cache_folder (str): folder of the parsed-result cache (see src/cache.py),
+    or None to parse every pdf
+
+    known_hashes (dict): sha256 of pdfs already downloaded from these URLs --
+    reports found in the cache under these hashes are not downloaded again
+
+    failed_reports (dict): (sha256, error) of pdfs of these URLs that failed to
+    parse -- reports whose pdf is unchanged are not parsed again and keep the error
+
+    Returns
+    -------
+    list
+        one dict per report, in the order of url_list, with keys url,
+        sha256 (of the pdf contents, None if it could not be downloaded),
+        report_date, num_pages, status
+        ('ok' or the error raised), cases (DataFrame with columns strain,
+        age, sex, date_onset, date_announced, poultry_exposure,
+        sick_human_exposure) and bad_dates (list of (report date, onset
+        date) pairs not matching the dd/mm/yyyy convention)
+    """
+    fetch_queue = queue.Queue(maxsize = queue_size)
+    parse_queue = queue.Queue(maxsize = queue_size)
+    annex_queue = queue.Queue(maxsize = queue_size)
+    reports = [{'url' : url, 'sha256' : None, 'report_date' : None, 'num_pages' : None, 'status' : 'ok',
+                'cases' : pd.DataFrame(columns = case_columns), 'bad_dates' : []}
+               for url in url_list]
+
+    def from_cache(report, sha256):
+        # Fill report from the cache, returns False on a cache miss
+        if cache_folder is None or sha256 is None:
+            return(False)
+        cached = get_cached(cache_folder, sha256)
+        if cached is None:
+            return(False)
+        report.update(cached)
+        report['sha256'] = sha256
+        print('Cached parse used for', report['url'])
+        return(True)
+
+    def finish(report):
+        if cache_folder is not None and report['status'] == 'ok':
+            # A failed cache write must not change the parse status
+            try:
+                put_cached(cache_folder, report['sha256'], report)
+            except Exception as error:
+                print('Could not cache', report['url'], '-', repr(error))
+        _finish(report)
+
+    def fetch(report):
+        try:
+            if known_hashes is not None and from_cache(report, known_hashes.get(report['url'])):
+                return(None)
+            report['folder'] = folder_location
+            report['file'] = download_pdf(report['url'], folder_location)
+            sha256 = hash_pdf(report['file'])
+            if from_cache(report, sha256):
+                _finish(report)
+                return(None)
+            report['sha256'] = sha256
+            if failed_reports is not None and failed_reports.get(report['url'], (None,))[0] == sha256:
+                # Same pdf as the last failed parse -- not retried until it changes
+                report['status'] = failed_reports[report['url']][1]
+                print('Unchanged since failed parse', report['url'])
+                _finish(report)
+                return(None)
+            return(report)
+        except Exception as error:
+            report['status'] = repr(error)
+            print('Could not download', report['url'], '-', report['status'])
+            _finish(report)
+            return(None)
+
+    def parse(report):
+        try:
+            # Waits for a process of the pool to parse the pdf
+            (report['report_date'], report['num_pages'], report['cases'],
+             report['annex_strains']) = executor.submit(_parse_file, report['file']).result()
+        except Exception as error:
+            report['status'] = repr(error)
+            print('Could not parse', report['url'], '-', report['status'])
+            report['annex_strains'] = []
+        if report['annex_strains'] == []:
+            finish(report)
+            return(None)
+        return(report)
+
+    def annex(report):
+        cases = [report['cases']]
+        rep, form = [], []
+        try:
+            report['pdfFileObj'] = open(report['file'], 'rb')
+            report['pdfReader'] = PyPDF2.PdfFileReader(report['pdfFileObj'])
+            for strain in report['annex_strains']:
+                cases.append(parse_annex_table(report['num_pages'], annex_strings[strain],
+                    strain, report['report_date'], report['pdfReader'], report['file'],
+                    bad_dates_rep = rep, bad_dates_for = form))
+        except Exception as error:
+            report['status'] = repr(error)
+            print('Could not parse annex table of', report['url'], '-', report['status'])
+        report['cases'] = pd.concat(cases, sort = False)
+        report['bad_dates'] = list(zip(rep, form))
+        finish(report)
+        return(None)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = parse_workers) as executor:
+        threads = (_run_stage(fetch, fetch_queue, parse_queue, fetch_workers, parse_workers)
+            + _run_stage(parse, parse_queue, annex_queue, parse_workers, annex_workers)
+            + _run_stage(annex, annex_queue, None, annex_workers, 0))
+        for report in reports:
+            fetch_queue.put(report)
+        for i in range(fetch_workers):
+            fetch_queue.put(_DONE)
+        for thread in threads:
+            thread.join()
+
+    for report in reports:
+        report.pop('annex_strains', None)
+    if cache_folder is not None:
+        prune_cache(cache_folder)
+    return(reports)
@@ -0,0 +1,283 @@
+# SQLite result store for read_pdf_url.py
+# Parsed reports and cases are upserted into a SQLite database on each run,
+# and the csv/parquet files in the results folder are exported from it.
+#
+# Tables:
+#   reports -- one row per report (url, sha256 of pdf, report date, page count, parse status,
+#       sha256 of the pdf that last failed to parse)
+#   cases   -- one row per case, indexed on strain, date_onset and date_announced
+#   index_state -- ETag/Last-Modified and content hash of the last index page seen
+#   incidence -- weekly/monthly case counts by strain, sex, age band and exposure,
+#       for onset and announced dates, updated as cases are upserted (see src/incidence.py)
+
+import re
+import sqlite3
+import datetime
+import collections
+import pandas as pd
+from parse_functions import case_columns
+
+schema = """
+CREATE TABLE IF NOT EXISTS reports (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT,
+    report_date TEXT,
+    num_pages INTEGER,
+    status TEXT,
+    parsed_at TEXT,
+    failed_sha256 TEXT
+);
+CREATE TABLE IF NOT EXISTS cases (
+    url TEXT NOT NULL REFERENCES reports(url),
+    case_num INTEGER NOT NULL,
+    strain TEXT,
+    age TEXT,
+    sex TEXT,
+    date_onset TEXT,
+    date_announced TEXT,
+    poultry_exposure TEXT,
+    sick_human_exposure TEXT,
+    PRIMARY KEY (url, case_num)
+);
+CREATE INDEX IF NOT EXISTS cases_strain ON cases (strain, date_onset);
+CREATE INDEX IF NOT EXISTS cases_date_onset ON cases (date_onset);
+CREATE INDEX IF NOT EXISTS cases_date_announced ON cases (date_announced);
+CREATE INDEX IF NOT EXISTS reports_sha256 ON reports (sha256);
+CREATE TABLE IF NOT EXISTS incidence (
+    date_kind TEXT,
+    freq TEXT,
+    period TEXT,
+    strain TEXT,
+    sex TEXT,
+    age_band TEXT,
+    exposure TEXT,
+    count INTEGER,
+    PRIMARY KEY (date_kind, freq, period, strain, sex, age_band, exposure)
+);
+CREATE TABLE IF NOT EXISTS index_state (
+    index_url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    sha256 TEXT
+);
+"""
+
+def open_store(db_path):
+    """Opens (and creates if needed) the SQLite result store at db_path"""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(schema)
+    # Stores created before failed parses were recorded
+    if 'failed_sha256' not in [row[1] for row in conn.execute("PRAGMA table_info(reports)")]:
+        conn.execute("ALTER TABLE reports ADD COLUMN failed_sha256 TEXT")
+    # Counts kept by another version of the banding (or before the incidence
+    # table existed) are recomputed from the cases
+    if conn.execute("PRAGMA user_version").fetchone()[0] != incidence_version:
+        with conn:
+            rebuild_incidence(conn)
+            conn.execute("PRAGMA user_version = {}".format(incidence_version))
+    return(conn)
+
+def iso_date(date):
+    """
+    Zero-pads yyyy-m-d dates to yyyy-mm-dd so they sort and range-filter
+    as strings. Values that are not dates (e.g. 'unknown') are returned as is.
+    """
+    match = re.match(r'^(\d{4})-(\d{1,2})-(\d{1,2})$', str(date))
+    if match is None:
+        return(date)
+    return('{}-{:0>2}-{:0>2}'.format(*match.groups()))
+
+# Version of the incidence counts, stored as the user_version of the database.
+# Bump when age_band or incidence_cells change, so existing counts are rebuilt.
+incidence_version = 2
+
+# Age bands of the incidence counts: (label, lowest age in band)
+age_bands = [('0-4', 0), ('5-14', 5), ('15-24', 15), ('25-44', 25), ('45-64', 45), ('65+', 65)]
+
+def age_band(age):
+    """
+    Returns the age band of an age in years, or 'unknown'. Ages given
+    in months (e.g. '8 months' in annex tables) are converted to years.
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)', str(age))
+    if match is None:
+        return('unknown')
+    years = float(match.group(1))
+    if re.search('[Mm]onth', str(age)):
+        years = years / 12
+    band = 'unknown'
+    for label, lowest in age_bands:
+        if years >= lowest:
+            band = label
+    return(band)
+
+def incidence_cells(row):
+    """
+    Returns the incidence cells a case is counted in: (date_kind, freq, 
+    period, strain, sex, age_band, exposure) for weekly and monthly periods
+    of its onset and announced dates. Periods are the Monday starting the
+    week (yyyy-mm-dd) or the month (yyyy-mm). Dates that cannot be read 
+    are left out.
+
+    Parameters
+    ----------
+    row (list): case values in the order of case_columns, with yyyy-mm-dd dates
+    """
+    strain, age, sex, date_onset, date_announced, poultry_exposure = row[:6]
+    sex = str(sex).strip().lower()[:1] if str(sex).strip().lower() in ['m', 'f', 'male', 'female'] else 'unknown'
+    exposure = str(poultry_exposure) if str(poultry_exposure) in ['0', '1'] else 'unknown'
+    cells = []
+    for date_kind, date in [('onset', date_onset), ('announced', date_announced)]:
+        try:
+            date = datetime.datetime.strptime(str(date), '%Y-%m-%d').date()
+        except ValueError:
+            continue
+        week = date - datetime.timedelta(days = date.weekday())
+        cells.append((date_kind, 'week', week.isoformat(), strain, sex, age_band(age), exposure))
+        cells.append((date_kind, 'month', date.strftime('%Y-%m'), strain, sex, age_band(age), exposure))
+    return(cells)
+
+def _update_incidence(conn, rows, sign):
+    """Adds (sign = 1) or removes (sign = -1) cases from the incidence counts"""
+    counts = collections.Counter(cell for row in rows for cell in incidence_cells(row))
+    for cell, count in counts.items():
+        conn.execute("INSERT OR IGNORE INTO incidence VALUES (?, ?, ?, ?, ?, ?, ?, 0)", cell)
+        conn.execute("UPDATE incidence SET count = count + ? WHERE date_kind = ? AND freq = ? "
+            "AND period = ? AND strain = ? AND sex = ? AND age_band = ? AND exposure = ?",
+            (sign * count,) + cell)
+
+def rebuild_incidence(conn):
+    """Recomputes the incidence counts from all cases in the store"""
+    conn.execute("DELETE FROM incidence")
+    _update_incidence(conn, conn.execute("SELECT " + ', '.join(case_columns) + " FROM cases"), 1)
+
+def parsed_urls(db_path):
+    """Returns set of report URLs already parsed without errors"""
+    conn = open_store(db_path)
+    urls = set(row[0] for row in conn.execute("SELECT url FROM reports WHERE status = 'ok'"))
+    conn.close()
+    return(urls)
+
+def report_hashes(db_path):
+    """Returns dict mapping report URLs to the sha256 of their pdf"""
+    conn = open_store(db_path)
+    hashes = dict(conn.execute("SELECT url, sha256 FROM reports WHERE sha256 IS NOT NULL"))
+    conn.close()
+    return(hashes)
+
+def failed_reports(db_path):
+    """
+    Returns dict mapping report URLs whose pdf failed to parse to 
+    (sha256 of that pdf, error). Reports that could not be downloaded
+    are left out, as their pdf is not known.
+    """
+    conn = open_store(db_path)
+    failed = {url : (sha256, status) for url, sha256, status in conn.execute(
+        "SELECT url, failed_sha256, status FROM reports WHERE status != 'ok' AND failed_sha256 IS NOT NULL")}
+    conn.close()
+    return(failed)
+
+def upsert_reports(db_path, reports):
+    """
+    Inserts or replaces reports and their cases in the result store.
+    Cases previously stored for a report are replaced by the new ones,
+    and the incidence counts are updated by the difference. Reports that
+    failed only have their status (and the sha256 of the pdf that failed,
+    if it was downloaded) updated, keeping their stored cases.
+
+    Parameters
+    ----------
+    db_path (str): path to the SQLite database
+
+    reports (list): dicts as returned by pipeline.run_pipeline
+    """
+    conn = open_store(db_path)
+    parsed_at = datetime.datetime.now().isoformat(timespec = 'seconds')
+    with conn:
+        for report in reports:
+            if report['status'] != 'ok':
+                # Only record the failure -- keep the hash and cases of the last
+                # successful parse, if any, until the report parses again
+                conn.execute("INSERT OR IGNORE INTO reports (url) VALUES (?)", (report['url'],))
+                conn.execute("UPDATE reports SET status = ?, parsed_at = ?, "
+                    "failed_sha256 = COALESCE(?, failed_sha256) WHERE url = ?",
+                    (report['status'], parsed_at, report['sha256'], report['url']))
+                continue
+            conn.execute("INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?, NULL)",
+                (report['url'], report['sha256'], iso_date(report['report_date']),
+                 report['num_pages'], report['status'], parsed_at))
+            _update_incidence(conn, conn.execute("SELECT " + ', '.join(case_columns) 
+                + " FROM cases WHERE url = ?", (report['url'],)).fetchall(), -1)
+            conn.execute("DELETE FROM cases WHERE url = ?", (report['url'],))
+            rows = [[None if pd.isna(value) else str(value) for value in row]
+                    for row in report['cases'][case_columns].values.tolist()]
+            rows = [row[:3] + [iso_date(row[3]), iso_date(row[4])] + row[5:] for row in rows]
+            conn.executemany("INSERT INTO cases VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [[report['url'], case_num] + row for case_num, row in enumerate(rows)])
+            _update_incidence(conn, rows, 1)
+        conn.execute("DELETE FROM incidence WHERE count <= 0")
+    conn.close()
+
+def read_index_state(db_path, index_url):
+    """Returns (etag, last_modified, sha256) of the last index page seen, or Nones"""
+    conn = open_store(db_path)
+    row = conn.execute("SELECT etag, last_modified, sha256 FROM index_state WHERE index_url = ?",
+        (index_url,)).fetchone()
+    conn.close()
+    if row is None:
+        return(None, None, None)
+    return(row)
+
+def write_index_state(db_path, index_url, etag, last_modified, sha256):
+    """Records ETag/Last-Modified and content hash of the index page"""
+    conn = open_store(db_path)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO index_state VALUES (?, ?, ?, ?)",
+            (index_url, etag, last_modified, sha256))
+    conn.close()
+
+def read_cases(db_path, strain = None, onset_from = None, onset_to = None,
+        announced_from = None, announced_to = None):
+    """
+    Returns cases from the result store, optionally filtered by strain and
+    by onset/announcement date windows (inclusive, yyyy-mm-dd)
+
+    Returns
+    -------
+    DataFrame Object
+        A dataframe with columns:
+        strain, age, sex, date_onset, date_announced, poultry_exposure, sick_human_exposure
+    """
+    filters = []
+    params = []
+    for column, operator, value in [('strain', '=', strain),
+                                    ('date_onset', '>=', onset_from),
+                                    ('date_onset', '<=', onset_to),
+                                    ('date_announced', '>=', announced_from),
+                                    ('date_announced', '<=', announced_to)]:
+        if value is not None:
+            filters.append(column + ' ' + operator + ' ?')
+            params.append(iso_date(value))
+    query = "SELECT " + ', '.join(case_columns) + " FROM cases"
+    if filters != []:
+        query = query + " WHERE " + ' AND '.join(filters)
+    query = query + " ORDER BY date_announced DESC, url, case_num"
+    conn = open_store(db_path)
+    df_cases = pd.read_sql_query(query, conn, params = params)
+    conn.close()
+    return(df_cases)
+
+def export_csv(db_path, strain, csv_path):
+    """Exports cases of strain from the result store to csv"""
+    read_cases(db_path, strain = strain).to_csv(csv_path)
+
+def export_parquet(db_path, parquet_path):
+    """
+    Exports all cases from the result store to parquet.
+    Requires pyarrow or fastparquet -- returns False if neither is installed.
+    """
+    try:
+        read_cases(db_path).to_parquet(parquet_path, index = False)
+    except ImportError:
+        return(False)
+    return(True)
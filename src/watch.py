@@ -0,0 +1,75 @@
+# Watch mode for read_pdf_url.py
+# Polls the WHO risk assessment index with conditional requests
+# (ETag/If-Modified-Since) and only parses reports when new pdf links
+# appear. An unchanged index costs one HTTP request per poll.
+
+import time
+import hashlib
+import datetime
+from parse_functions import fetch_index, pdf_links
+from store import read_index_state, write_index_state
+
+def poll_index(index_url, db_path):
+    """
+    Checks the index page once for changes since the last poll
+
+    Parameters
+    ----------
+    index_url (str): URL of the page listing the pdf reports
+
+    db_path (str): path to the SQLite result store holding the index state
+
+    Returns
+    -------
+    url_list (list or None): pdf links on the index page, or None if the
+    page is unchanged
+
+    state (tuple): (etag, last_modified, sha256) of the page, to record
+    with store.write_index_state once the new links are parsed
+    """
+    etag, last_modified, sha256 = read_index_state(db_path, index_url)
+    html, new_etag, new_last_modified = fetch_index(index_url, etag, last_modified)
+    if html is None:
+        return(None, (etag, last_modified, sha256))
+    # Servers without ETag/Last-Modified support send the full page each time
+    new_sha256 = hashlib.sha256(html).hexdigest()
+    if new_sha256 == sha256:
+        return(None, (new_etag, new_last_modified, sha256))
+    return(pdf_links(html), (new_etag, new_last_modified, new_sha256))
+
+def watch_index(index_url, db_path, update_results, interval = 3600):
+    """
+    Polls the index page every interval seconds and calls
+    update_results(url_list) when it changes. Runs until interrupted.
+
+    Parameters
+    ----------
+    index_url (str): URL of the page listing the pdf reports
+
+    db_path (str): path to the SQLite result store holding the index state
+
+    update_results (function): parses reports in url_list that are not yet
+    in the result store and updates the outputs, returning False if any
+    report could not be downloaded
+
+    interval (int): seconds between polls
+    """
+    while True:
+        try:
+            url_list, state = poll_index(index_url, db_path)
+            if url_list is None:
+                print(datetime.datetime.now().isoformat(timespec = 'seconds'), 'index unchanged')
+            else:
+                print(datetime.datetime.now().isoformat(timespec = 'seconds'), 'index changed')
+                if not update_results(url_list):
+                    # Leave the index state as it was, so the next poll sees
+                    # the index as changed and retries the downloads. Reports
+                    # that failed to parse are recorded with their pdf hash
+                    # in the store and are not retried until the pdf changes.
+                    print('Some reports could not be downloaded -- retrying on next poll')
+                    time.sleep(interval)
+                    continue
+            write_index_state(db_path, index_url, *state)
+        except Exception as error:
+            print('Could not update from', index_url, '-', repr(error))
+        time.sleep(interval)
@@ -0,0 +1,61 @@
+# Checks for the parsed-result cache in src/cache.py
+#
+# Run from the repository root with: python -m pytest test
+
+import os
+import sys
+import threading
+sys.path.append('src')
+import pandas as pd
+from parse_functions import case_columns
+from cache import get_cached, put_cached, prune_cache, parser_version, _entry_path
+
+def make_report(num_cases = 2):
+    cases = pd.DataFrame([['H7N9', '59', 'f', '2018-2-3', '2018-4-9', 1, 0]] * num_cases, columns = case_columns)
+    return({'report_date' : '2018-4-9', 'num_pages' : 5, 'cases' : cases, 'bad_dates' : []})
+
+def test_put_cached_concurrent(tmp_path):
+    # Identical pdfs under different URLs are cached by pipeline threads sharing one pid
+    cache_folder = str(tmp_path)
+    for i in range(20):
+        errors = []
+        def put():
+            try:
+                put_cached(cache_folder, 'abc' + str(i), make_report())
+            except Exception as error:
+                errors.append(error)
+        threads = [threading.Thread(target = put) for j in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert len(get_cached(cache_folder, 'abc' + str(i))['cases']) == 2
+    assert [name for name in tmp_path.iterdir() if name.suffix == '.tmp'] == []
+
+def test_get_cached(tmp_path):
+    cache_folder = str(tmp_path)
+    assert get_cached(cache_folder, 'abc') is None
+    put_cached(cache_folder, 'abc', make_report())
+    cached = get_cached(cache_folder, 'abc')
+    assert cached['cases'].values.tolist() == make_report()['cases'].values.tolist()
+    assert (cached['report_date'], cached['num_pages'], cached['bad_dates']) == ('2018-4-9', 5, [])
+    # Unreadable entries are deleted and treated as a miss
+    path = _entry_path(cache_folder, 'abc')
+    with open(path, 'wb') as file:
+        file.write(b'not a pickle')
+    assert get_cached(cache_folder, 'abc') is None
+    assert not os.path.exists(path)
+
+def test_prune_cache(tmp_path):
+    cache_folder = str(tmp_path)
+    for i in range(3):
+        put_cached(cache_folder, 'abc' + str(i), make_report())
+        os.utime(_entry_path(cache_folder, 'abc' + str(i)), (i, i))
+    # Entries of another parser version are deleted, those of another backend kept
+    (tmp_path / ('abc-0000000000000000-' + 'f' * 8 + '.pkl')).write_bytes(b'')
+    (tmp_path / ('abc-' + parser_version + '-' + 'f' * 8 + '.pkl')).write_bytes(b'')
+    prune_cache(cache_folder, max_entries = 3)
+    assert sorted(name.name for name in tmp_path.iterdir()) == sorted(
+        [os.path.basename(_entry_path(cache_folder, 'abc' + str(i))) for i in [1, 2]]
+        + ['abc-' + parser_version + '-' + 'f' * 8 + '.pkl'])
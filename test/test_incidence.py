@@ -0,0 +1,15 @@
+# Checks for the incidence arrays in src/incidence.py
+#
+# Run from the repository root with: python -m pytest test
+
+import sys
+sys.path.append('src')
+from incidence import incidence_array, incidence_frame, dimensions
+
+def test_empty_store(tmp_path):
+    db_path = str(tmp_path / 'store.sqlite')
+    counts, axes = incidence_array(db_path, 'onset', 'week')
+    assert counts.shape == (0, 2, 3, 7, 3)
+    df_counts = incidence_frame(db_path, 'announced', 'month')
+    assert df_counts.shape == (0, 2 * 3 * 7 * 3)
+    assert list(df_counts.columns.names) == list(dimensions)
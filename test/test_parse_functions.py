@@ -0,0 +1,47 @@
+# Regression checks for the case-paragraph tokenizer in src/parse_functions.py
+# Expected values are those returned by the previous per-field detectors
+# (detect_patient_gender, detect_onset_date, detect_poultry_exposure)
+#
+# Run from the repository root with: python -m pytest test
+
+import sys
+sys.path.append('src')
+from parse_functions import parse_case_span, parse_case_paragraph, split_cases
+
+report_date = '2019-5-10'
+
+# (case description, (gender, onset date, poultry exposure, sick human exposure))
+spans = [
+    ('. She kept her poultry at home. ', ('f', None, 1, 0)),
+    ('. Her exposure to birds is not known. He had exposure to sick birds before onset on 9 May. ',
+        ('m', '2019-5-9', 0, 0)),
+    ('. She developed fever on 17 March. The man had onset on 18 March and was hospitalized. '
+        'She had contact with dead birds at home. ', ('m', '2019-3-18', 1, 0)),
+    ('. The patient had no known exposure to poultry; A woman developed symptoms on 3 February. ',
+        ('f', '2019-2-3', 0, 0)),
+    ('. The woman raised backyard poultry and ducks. Illness onset was 2 April. ', ('f', '2019-4-2', 1, 0)),
+    ('. It was a female patient. He visited a live bird market. Symptoms began on 21 January. '
+        'He had exposure to sick poultry. ', ('f', '2019-1-21', 1, 0)),
+    ('. The case is male. No poultry exposure was reported. ', ('m', None, 0, 0)),
+    ]
+
+def test_parse_case_span():
+    for span, (gender, onset_date, poultry_exposure, sick_human_exposure) in spans:
+        result = parse_case_span(span, report_date)
+        if onset_date is None:
+            assert result[1].startswith('check onset date format'), span
+            result = (result[0], None) + result[2:]
+        assert result == (gender, onset_date, poultry_exposure, sick_human_exposure), span
+
+def test_parse_case_paragraph():
+    info_par = ("Avian influenza A(H7N9) Since the last update, two new laboratory-confirmed cases were reported. "
+        "The first case is a 59-year-old female who developed symptoms on 3 February. She kept her poultry at home. "
+        "The second case is a 82-year-old male who had onset on 18 March. He had no known exposure to sick poultry .")
+    df_cases = parse_case_paragraph(info_par, 2, 'H7N9', '2018-4-9')
+    assert df_cases.values.tolist() == [
+        ['H7N9', '59', 'f', '2018-2-3', '2018-4-9', 1, 0],
+        ['H7N9', '82', 'm', '2018-3-18', '2018-4-9', 0, 0]]
+
+def test_split_cases_month_ages():
+    info_par = "two new cases. A 8-month-old boy fell ill. A 35-year-old woman fell ill."
+    assert [age for age, span in split_cases(info_par, 2)] == ['8 months', '35']
@@ -0,0 +1,100 @@
+# Checks for the staged pipeline in src/pipeline.py, with the download and
+# parsing functions replaced by stubs. The stubs reach the text extraction
+# processes by fork.
+#
+# Run from the repository root with: python -m pytest test
+
+import os
+import sys
+import queue
+import multiprocessing
+sys.path.append('src')
+import pytest
+import pandas as pd
+import PyPDF2
+import pipeline
+from parse_functions import case_columns, pdf_filename
+
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+    reason = 'stubs only reach forked worker processes')
+
+class FakeReader():
+    numPages = 3
+    def __init__(self, pdfFileObj):
+        self.name = pdfFileObj.name.split('_')[-1]
+
+def download_pdf(download_url, folder_location):
+    if 'offline' in download_url:
+        raise OSError('offline')
+    path = folder_location + '/' + pdf_filename(download_url)
+    # Pdfs with the same filename have the same contents
+    with open(path, 'wb') as file:
+        file.write(download_url.split('/')[-1].encode())
+    return(path)
+
+def parse_report(pdfReader, num_pages):
+    if pdfReader.name == 'bad.pdf':
+        raise KeyError('eleven')
+    cases = pd.DataFrame([['H7N9', '59', 'f', '2018-2-3', '2018-4-9', 1, 0]], columns = case_columns)
+    return('2018-4-9', cases, ['H5N1'] if pdfReader.name == 'annex.pdf' else [])
+
+def parse_annex_table(num_pages, annex_string, strain, report_date, pdfReader, file,
+        bad_dates_rep = [], bad_dates_for = []):
+    bad_dates_rep.append(report_date)
+    bad_dates_for.append('2018-13-1')
+    return(pd.DataFrame([['H5N1', '8 months', 'm', '2018-3-1', '2018-4-9', 1, 0]], columns = case_columns))
+
+@pytest.fixture
+def stubs(monkeypatch):
+    monkeypatch.setattr(PyPDF2, 'PdfFileReader', FakeReader)
+    monkeypatch.setattr(pipeline, 'download_pdf', download_pdf)
+    monkeypatch.setattr(pipeline, 'parse_report', parse_report)
+    monkeypatch.setattr(pipeline, 'parse_annex_table', parse_annex_table)
+
+def test_run_pipeline(tmp_path, stubs):
+    urls = ['http://a/ok.pdf', 'http://a/bad.pdf', 'http://offline/x.pdf', 'http://a/annex.pdf']
+    reports = pipeline.run_pipeline(urls, str(tmp_path), fetch_workers = 2, parse_workers = 2, queue_size = 1)
+    assert [report['url'] for report in reports] == urls
+    assert [report['status'] for report in reports] == ['ok', "KeyError('eleven')", "OSError('offline')", 'ok']
+    # Download failures have no pdf hash, so they are retried
+    assert [report['sha256'] is None for report in reports] == [False, False, True, False]
+    assert [len(report['cases']) for report in reports] == [1, 0, 0, 2]
+    assert reports[3]['bad_dates'] == [('2018-4-9', '2018-13-1')]
+    assert os.listdir(str(tmp_path)) == []
+
+def test_run_pipeline_cache(tmp_path, stubs):
+    folder, cache_folder = str(tmp_path / 'pdfs'), str(tmp_path / 'cache')
+    os.mkdir(folder)
+    # Identical pdfs under different URLs are cached by several threads at once
+    urls = ['http://a/annex.pdf', 'http://b/annex.pdf', 'http://c/annex.pdf']
+    reports = pipeline.run_pipeline(urls, folder, cache_folder = cache_folder)
+    assert [report['status'] for report in reports] == ['ok'] * 3
+    known_hashes = {'http://d/annex.pdf' : reports[0]['sha256']}
+    # Found in the cache without downloading
+    reports = pipeline.run_pipeline(['http://d/annex.pdf', 'http://offline/annex.pdf'], folder,
+        cache_folder = cache_folder, known_hashes = known_hashes)
+    assert [report['status'] for report in reports] == ['ok', "OSError('offline')"]
+    assert len(reports[0]['cases']) == 2
+
+def test_run_pipeline_failed_reports(tmp_path, stubs):
+    reports = pipeline.run_pipeline(['http://a/bad.pdf'], str(tmp_path))
+    failed_reports = {'http://a/bad.pdf' : (reports[0]['sha256'], 'earlier error')}
+    reports = pipeline.run_pipeline(['http://a/bad.pdf'], str(tmp_path), failed_reports = failed_reports)
+    assert reports[0]['status'] == 'earlier error'
+
+def test_run_stage_error():
+    # A report whose work raises is marked failed and the other reports still pass
+    inbox, outbox = queue.Queue(), queue.Queue()
+    def work(report):
+        if report['url'] == 'bad':
+            raise ValueError('bad')
+        return(report)
+    threads = pipeline._run_stage(work, inbox, outbox, 2, 1)
+    reports = [{'url' : url, 'status' : 'ok'} for url in ['a', 'bad', 'b']]
+    for report in reports + [pipeline._DONE] * 2:
+        inbox.put(report)
+    for thread in threads:
+        thread.join(timeout = 10)
+        assert not thread.is_alive()
+    assert sorted(report['url'] for report in iter(outbox.get_nowait, pipeline._DONE)) == ['a', 'b']
+    assert reports[1]['status'] == "ValueError('bad')"
@@ -0,0 +1,67 @@
+# Checks for the SQLite result store in src/store.py
+#
+# Run from the repository root with: python -m pytest test
+
+import sys
+sys.path.append('src')
+import pandas as pd
+from parse_functions import case_columns
+from store import (open_store, upsert_reports, incidence_version, age_band, read_cases,
+    parsed_urls, report_hashes, failed_reports)
+
+def make_report(url, rows, status = 'ok', sha256 = 'abc'):
+    return({'url' : url, 'sha256' : sha256, 'report_date' : '2018-4-9', 'num_pages' : 5,
+            'status' : status, 'cases' : pd.DataFrame(rows, columns = case_columns), 'bad_dates' : []})
+
+def onset_cells(db_path):
+    conn = open_store(db_path)
+    cells = conn.execute("SELECT age_band, count FROM incidence WHERE date_kind = 'onset' "
+        "AND freq = 'month'").fetchall()
+    conn.close()
+    return(cells)
+
+def test_incidence_rebuilt_for_old_banding(tmp_path):
+    db_path = str(tmp_path / 'store.sqlite')
+    upsert_reports(db_path, [make_report('a', [['H7N9', '8 months', 'm', '2018-2-3', '2018-4-9', '1', '0']])])
+    # Counts kept by a store from before months were converted
+    conn = open_store(db_path)
+    with conn:
+        conn.execute("UPDATE incidence SET age_band = '5-14'")
+        conn.execute("PRAGMA user_version = {}".format(incidence_version - 1))
+    conn.close()
+    assert onset_cells(db_path) == [('0-4', 1)]
+
+def test_age_band():
+    # Paragraph and annex ages in months are both written as 'N months'
+    assert [age_band(age) for age in ['8 months', '18 Months', '8', '35', '70', 'unknown']] == [
+        '0-4', '0-4', '5-14', '25-44', '65+', 'unknown']
+
+def test_failed_report_keeps_cases(tmp_path):
+    db_path = str(tmp_path / 'store.sqlite')
+    rows = [['H7N9', '59', 'f', '2018-2-3', '2018-4-9', '1', '0'], ['H7N9', '82', 'm', '2018-3-18', '2018-4-9', '0', '0']]
+    upsert_reports(db_path, [make_report('a', rows)])
+    upsert_reports(db_path, [make_report('a', [], status = "KeyError('eleven')", sha256 = 'def')])
+    assert len(read_cases(db_path)) == 2
+    assert report_hashes(db_path) == {'a' : 'abc'}
+    assert parsed_urls(db_path) == set()
+    assert failed_reports(db_path) == {'a' : ('def', "KeyError('eleven')")}
+    # Reports that could not be downloaded keep the hash of the last failed parse
+    upsert_reports(db_path, [make_report('a', [], status = "OSError('down')", sha256 = None)])
+    assert failed_reports(db_path) == {'a' : ('def', "OSError('down')")}
+    upsert_reports(db_path, [make_report('a', rows[:1])])
+    assert parsed_urls(db_path) == {'a'}
+    assert failed_reports(db_path) == {}
+
+def test_incidence_after_reupsert(tmp_path):
+    db_path = str(tmp_path / 'store.sqlite')
+    upsert_reports(db_path, [make_report('a', [['H7N9', '59', 'f', '2018-2-3', '2018-4-9', '1', '0'],
+                                                ['H7N9', '8 months', 'm', '2018-2-5', '2018-4-9', '1', '0']])])
+    assert sorted(onset_cells(db_path)) == [('0-4', 1), ('45-64', 1)]
+    # Re-upserting the report replaces its cases in the counts
+    upsert_reports(db_path, [make_report('a', [['H7N9', '60', 'f', '2018-2-3', '2018-4-9', '1', '0']]),
+                             make_report('b', [['H7N9', '61', 'f', '2018-2-9', '2018-4-9', '1', '0']])])
+    assert onset_cells(db_path) == [('45-64', 2)]
+    conn = open_store(db_path)
+    counts = sorted(conn.execute("SELECT freq, period, count FROM incidence WHERE date_kind = 'onset'"))
+    conn.close()
+    assert counts == [('month', '2018-02', 2), ('week', '2018-01-29', 1), ('week', '2018-02-05', 1)]
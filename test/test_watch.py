@@ -0,0 +1,39 @@
+# Checks for the index polling in src/watch.py
+#
+# Run from the repository root with: python -m pytest test
+
+import sys
+sys.path.append('src')
+import watch
+from store import write_index_state
+
+index_url = 'https://www.who.int/influenza/human_animal_interface/HAI_Risk_Assessment/en/'
+html = b'<a href="/influenza/a.pdf">a</a><a href="https://www.who.int/b.pdf">b</a><a href="/c.html">c</a>'
+
+def test_poll_index(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'store.sqlite')
+    requests = []
+    def fetch_index(url, etag = None, last_modified = None):
+        requests.append((etag, last_modified))
+        if etag == '"1"':
+            return(None, etag, last_modified)
+        return(html, '"1"', 'Mon, 01 Jun 2020 00:00:00 GMT')
+    monkeypatch.setattr(watch, 'fetch_index', fetch_index)
+    url_list, state = watch.poll_index(index_url, db_path)
+    assert url_list == ['https://www.who.int/influenza/a.pdf', 'https://www.who.int/b.pdf']
+    write_index_state(db_path, index_url, *state)
+    # Unchanged index (304) -- one conditional request, no links
+    url_list, new_state = watch.poll_index(index_url, db_path)
+    assert url_list is None and new_state == state
+    assert requests == [(None, None), ('"1"', 'Mon, 01 Jun 2020 00:00:00 GMT')]
+
+def test_poll_index_without_conditional_requests(tmp_path, monkeypatch):
+    # Servers ignoring ETag/If-Modified-Since send the full page each time
+    db_path = str(tmp_path / 'store.sqlite')
+    monkeypatch.setattr(watch, 'fetch_index', lambda url, etag = None, last_modified = None: (html, None, None))
+    url_list, state = watch.poll_index(index_url, db_path)
+    write_index_state(db_path, index_url, *state)
+    assert watch.poll_index(index_url, db_path) == (None, state)
+    monkeypatch.setattr(watch, 'fetch_index', lambda url, etag = None, last_modified = None:
+        (html + b'<a href="/d.pdf">d</a>', None, None))
+    assert watch.poll_index(index_url, db_path)[0][-1] == 'https://www.who.int/d.pdf'